@@ -0,0 +1,140 @@
+'''
+Reads PDFs straight out of .tgz/.tar.gz/.zip archives, so that
+proceedings tarballs can be checked without extracting them to disk.
+For checks split across machines, stage() unpacks the PDFs once into a
+spool directory that the workers share.
+'''
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import zipfile
+from os.path import basename
+
+
+ARCHIVE_SUFFIXES = ('.tgz', '.tar.gz', '.zip')
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def member_label(archive, member):
+    '''The name a member is reported under: "archive:member".'''
+    return f"{archive}:{member}"
+
+
+def split_label(label):
+    '''Inverse of member_label; member is None for plain files.'''
+    for suffix in ARCHIVE_SUFFIXES:
+        index = label.lower().find(suffix + ':')
+        if index >= 0:
+            end = index + len(suffix)
+            return label[:end], label[end + 1:]
+    return label, None
+
+
+def archive_stem(archive):
+    '''"data/naacl/proceedings.tgz" -> "naacl-proceedings.tgz"'''
+    parts = archive.replace('\\', '/').split('/')
+    return '-'.join(p for p in parts[-2:] if p not in ('', '.', '..'))
+
+
+def iter_archive_pdfs(archive, keep=None):
+    '''Yields (label, bytes) for each PDF in the archive, in archive order.
+    If keep is given, members whose label it rejects are not read.
+
+    Tarballs are read as a single stream; zip members are read directly
+    from the central directory offsets.'''
+    if archive.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.lower().endswith('.pdf'):
+                    label = member_label(archive, info.filename)
+                    if keep is None or keep(label):
+                        yield label, zf.read(info)
+    else:
+        with tarfile.open(archive, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile() and member.name.lower().endswith('.pdf'):
+                    label = member_label(archive, member.name)
+                    if keep is None or keep(label):
+                        yield label, tar.extractfile(member).read()
+
+
+def iter_pdfs(paths):
+    '''Yields (label, source) for PDF files and for PDFs inside archives.
+
+    source is the path for plain files and the member's bytes for archive
+    members; pass it through as_file before opening it.'''
+    for path in paths:
+        if is_archive(path):
+            yield from iter_archive_pdfs(path)
+        else:
+            yield path, path
+
+
+def as_file(source):
+    '''Returns something pdfplumber.open accepts for an iter_pdfs source.'''
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def pdf_basename(label):
+    '''The file name of a plain PDF or of an archive member.'''
+    _, member = split_label(label)
+    return basename(member if member is not None else label)
+
+
+def signature(path):
+    '''Changes when the file at path is replaced or modified.'''
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def _spool_name(name):
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16] + '.pdf'
+
+
+def stage(paths, spool_dir, keep=None):
+    '''Yields (label, path) for the PDFs in paths, like iter_pdfs, but
+    with archive members written to files in spool_dir.  If keep is
+    given, PDFs whose label it rejects are skipped.
+
+    Each archive is decompressed once, here, so that workers (see
+    jobqueue) on any machine that shares spool_dir can read single
+    members.  The members of an archive are spooled under its path, size
+    and modification time, so a later run over the same archive reuses
+    them and a changed archive is spooled again.'''
+    for path in paths:
+        if not is_archive(path):
+            if keep is None or keep(path):
+                yield path, path
+            continue
+
+        dest_dir = os.path.join(spool_dir, _spool_name(
+            f'{os.path.abspath(path)}:{signature(path)}')[:-4])
+        manifest = os.path.join(dest_dir, 'members.json')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                members = json.load(f)
+        else:
+            os.makedirs(dest_dir, exist_ok=True)
+            members = []
+            for label, data in iter_archive_pdfs(path):
+                member = split_label(label)[1]
+                dest = os.path.join(dest_dir, _spool_name(member))
+                with open(dest + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(dest + '.tmp', dest)
+                members.append(member)
+            # written last: an interrupted run is spooled again
+            with open(manifest + '.tmp', 'w') as f:
+                json.dump(members, f)
+            os.replace(manifest + '.tmp', manifest)
+
+        for member in members:
+            label = member_label(path, member)
+            if keep is None or keep(label):
+                yield label, os.path.join(dest_dir, _spool_name(member))
@@ -0,0 +1,181 @@
+'''
+python3 authors.py [--index authors.tsv] [--unified unified-authors.tsv] db [db ...]
+
+Builds the author index of one or more volumes (e.g., all workshops of
+an event) from their db files.  Names are normalized once when a paper
+is added, and variant spellings of the same name (differing only in
+accents, case, punctuation or "Last, First" order) are merged under a
+hash index of name keys, so adding a paper costs time proportional to
+its number of authors.  The index is kept sorted as papers are added,
+so it can be written out at any point without re-sorting.
+
+Writes the author index (name, then the papers, tab-separated) and the
+unified-authors mapping (each variant spelling, then the name it is
+listed under).
+'''
+
+import argparse
+import bisect
+import collections
+import os
+import regex as re
+import unicodedata
+
+
+# letters that NFKD does not decompose; see also bin/manage-db.pl
+_SPECIAL_LETTERS = str.maketrans({
+    'Đ': 'D', 'đ': 'd', 'Ħ': 'H', 'ħ': 'h', 'ı': 'i', 'ȷ': 'j', 'Ł': 'L', 'ł': 'l',
+    'Ø': 'O', 'ø': 'o', 'Ŧ': 'T', 'ŧ': 't', 'Æ': 'AE', 'æ': 'ae', 'Œ': 'OE',
+    'œ': 'oe', 'ẞ': 'SS', 'ß': 'ss', 'Þ': 'Th', 'þ': 'th', 'Ŋ': 'Ng', 'ŋ': 'ng',
+})
+
+
+def clean(value):
+    '''Unicode cleanup of names and titles: straight quotes, simple dashes,
+    stripped whitespace and NFKC-composed accents.'''
+    # uncurl all quotes
+    value = re.sub(r'[\u2018\u2019]', "'", value)
+    value = re.sub(r'[\u201C\u201D]', '"', value)
+    # use simple dashes
+    value = re.sub(r'[\u2013\u2014]', "-", value)
+    # not exactly sure why, but this has to be done iteratively
+    old_value = None
+    value = value.strip()
+    while old_value != value:
+        old_value = value
+        # strip space before accent; PDF seems to introduce these
+        value = re.sub(r'\p{Zs}+(\p{Mn})', r'\1', value)
+        # combine accents with characters
+        value = unicodedata.normalize('NFKC', value)
+    return value
+
+
+def fold(value):
+    '''Removes accents, case and punctuation from a cleaned string.'''
+    value = unicodedata.normalize('NFKD', value.translate(_SPECIAL_LETTERS))
+    value = re.sub(r'\p{Mn}+', '', value).casefold()
+    # O'Brien and OBrien are the same name, but O Brien is not
+    value = re.sub(r"['\u02BC`]", '', value)
+    value = re.sub(r'[^\p{L}\p{N},]+', ' ', value)
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def name_key(name):
+    '''The key under which variant spellings of a name are merged; "Last,
+    First" and "First Last" get the same key.'''
+    folded = fold(clean(name))
+    if ',' in folded:
+        last, first = folded.split(',', 1)
+        folded = f'{first} {last}'
+    return ' '.join(folded.replace(',', ' ').split())
+
+
+def sort_key(name):
+    '''Sorts names by last name, ignoring accents and case.'''
+    folded = fold(clean(name))
+    if ',' not in folded:
+        parts = folded.rsplit(' ', 1)
+        folded = ', '.join(reversed(parts)) if len(parts) == 2 else folded
+    return folded, name
+
+
+class Author(object):
+
+    def __init__(self, key):
+        self.key = key
+        self.spellings = collections.Counter()
+        self.papers = []
+
+    @property
+    def name(self):
+        '''The most frequent spelling, or the first one seen on a tie.'''
+        return self.spellings.most_common(1)[0][0]
+
+
+class AuthorRegistry(object):
+    '''Authors of all papers added so far, merged by name_key.'''
+
+    def __init__(self):
+        self.authors = {}
+        # (sort_key, author key) pairs, kept sorted
+        self._sorted = []
+
+    def add_paper(self, paper, names):
+        '''Adds paper (any label, e.g. "acl-1") by the given author names.
+        Returns the authors whose index entry is new or changed.'''
+        changed = []
+        for name in names:
+            name = clean(name)
+            key = name_key(name)
+            if not key:
+                continue
+            author = self.authors.get(key)
+            if author is None:
+                author = self.authors[key] = Author(key)
+            old_name = author.name if author.spellings else None
+            author.spellings[name] += 1
+            entry_changed = old_name != author.name
+            if paper not in author.papers:
+                author.papers.append(paper)
+                entry_changed = True
+            if old_name != author.name:
+                if old_name is not None:
+                    del self._sorted[bisect.bisect_left(self._sorted, (sort_key(old_name), key))]
+                bisect.insort(self._sorted, (sort_key(author.name), key))
+            if entry_changed and author not in changed:
+                changed.append(author)
+        return changed
+
+    def index(self):
+        '''Yields (name, papers) in author-index order.'''
+        for _, key in self._sorted:
+            author = self.authors[key]
+            yield author.name, author.papers
+
+    def unified(self):
+        '''Yields (spelling, name) for every spelling of every author.'''
+        for _, key in self._sorted:
+            author = self.authors[key]
+            for spelling in sorted(author.spellings):
+                yield spelling, author.name
+
+
+def read_db_authors(db_path):
+    '''Yields (paper ID, author names) for each paper with a file in a db.'''
+    record = collections.defaultdict(list)
+    with open(db_path, encoding='utf-8') as db:
+        for line in list(db) + ['\n']:
+            match = re.match(r'^(.):\s*(.+?)\s*$', line)
+            if match:
+                record[match.group(1)].append(match.group(2))
+            elif not line.strip() and record:
+                if 'F' in record and 'P' in record and 'X' not in record:
+                    yield record['P'][0], record['A']
+                record = collections.defaultdict(list)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('db_paths', metavar='db', nargs='+')
+    parser.add_argument('--index', default='authors.tsv')
+    parser.add_argument('--unified', default='unified-authors.tsv')
+    args = parser.parse_args()
+
+    registry = AuthorRegistry()
+    for db_path in args.db_paths:
+        # papers are labelled by the directory of their volume
+        volume = os.path.basename(os.path.dirname(os.path.abspath(db_path)))
+        for paper_id, names in read_db_authors(db_path):
+            registry.add_paper(f'{volume}-{paper_id}', names)
+
+    with open(args.index, 'w', encoding='utf-8') as f:
+        for name, papers in registry.index():
+            f.write(f"{name}\t{', '.join(papers)}\n")
+    with open(args.unified, 'w', encoding='utf-8') as f:
+        for spelling, name in registry.unified():
+            f.write(f'{spelling}\t{name}\n')
+    print(f'{len(registry.authors)} authors in {args.index}; variants in {args.unified}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
 '''
-python3 formatchecker.py [-h] [--paper_type {long,short,other}] file_or_dir [file_or_dir ...]
+python3 formatchecker.py [-h] [--paper_type {long,short,other}] file_dir_or_archive [file_dir_or_archive ...]
+
+PDFs inside .tgz/.tar.gz/.zip archives are checked without extracting
+them; their logs are named after the archive and the paper.
+
+To split the check across machines that share a filesystem, queue the
+papers and wait for the merged report with
+    python3 formatchecker.py --queue spool:/shared/checks [--report report.json] file_dir_or_archive ...
+and start any number of workers (on any machine) with
+    python3 formatchecker.py --queue spool:/shared/checks --worker [--num_workers N]
+On a single machine, an SQLite file (e.g. --queue checks.db) will also do.
 '''
 
 # TODO: make the script pip installable
@@ -9,10 +19,16 @@ import json
 from enum import Enum
 from collections import defaultdict
 from os import walk
-from os.path import isfile, join
+from os.path import abspath, isfile, join
+import numpy as np
 import pdfplumber
 from tqdm import tqdm
 from termcolor import colored
+try:
+    from . import archives, jobqueue
+except ImportError:  # run as a script
+    import archives
+    import jobqueue
 
 
 class Error(Enum):
@@ -42,6 +58,33 @@ class Margin(Enum):
     LEFT = "left"
 
     
+# boxes closer than this (in pixels, 72ppi) are reported as one region
+REGION_GAP = 20
+
+
+def _box_array(objs):
+    '''Packs pdfplumber words or images into an (n, 4) array of
+    (x0, x1, top, bottom).'''
+    return np.array([(o["x0"], o["x1"], o["top"], o["bottom"]) for o in objs],
+                    dtype=np.float64).reshape(-1, 4)
+
+
+def _cluster_boxes(boxes, axis):
+    '''Merges boxes whose extent along `axis` (0 for x, 2 for y) overlaps
+    or lies within REGION_GAP, returning the bounding box of each cluster.'''
+    boxes = boxes[np.argsort(boxes[:, axis], kind="stable")]
+    start, end = boxes[:, axis], boxes[:, axis+1]
+    reach = np.maximum.accumulate(end)
+    breaks = np.flatnonzero(start[1:] > reach[:-1] + REGION_GAP) + 1
+    offsets = np.concatenate(([0], breaks))
+    return np.column_stack((
+        np.minimum.reduceat(boxes[:, 0], offsets),
+        np.maximum.reduceat(boxes[:, 1], offsets),
+        np.minimum.reduceat(boxes[:, 2], offsets),
+        np.maximum.reduceat(boxes[:, 3], offsets),
+    ))
+
+
 class Formatter(object):
     
     def __init__(self):
@@ -49,14 +92,21 @@ class Formatter(object):
         self.right_offset = 4.5
         self.left_offset = 2
         self.top_offset = 1
+        self.bottom_offset = 1
         
 
-    def format_check(self, submission, paper_type):
+    def format_check(self, submission, paper_type, pdf_file=None):
+        '''Checks the pdf named submission; pdf_file, if given, is read
+        instead of the file of that name (e.g., an archive member).'''
         print(f"Checking {submission}")
 
         # TOOD: make this less of a hackg
-        self.number = submission.split("/")[-1].split("_")[0].replace(".pdf", "")
-        self.pdf = pdfplumber.open(submission)
+        self.number = archives.pdf_basename(submission).split("_")[0].replace(".pdf", "")
+        archive, member = archives.split_label(submission)
+        if member is not None:
+            # papers in different archives may share a number
+            self.number = "{0}-{1}".format(archives.archive_stem(archive), self.number)
+        self.pdf = pdfplumber.open(pdf_file if pdf_file is not None else submission)
         self.logs = defaultdict(list)  # reset log before calling the format-checking functions
         self.page_errors = set()
 
@@ -109,6 +159,8 @@ class Formatter(object):
         else:
             print(colored("All Clear!", "green"))
 
+        return logs_json
+
             
     def check_page_size(self):
         '''Checks the paper size (A4) of each pages in the submission.'''
@@ -127,39 +179,20 @@ class Formatter(object):
     def check_page_margin(self):
         '''Checks if any text or figure is in the margin of pages.'''
 
-        pages_image = defaultdict(list)
-        pages_text = defaultdict(list)
+        pages_image = {}
+        pages_text = {}
         perror = []
         for i, p in enumerate(self.pdf.pages):
             if i+1 in self.page_errors:
                 continue
             try:
-                # Parse images
-                # 57 pixels (72ppi) = 2cm; 71 pixels (72ppi) = 2.5cm.
-                for image in p.images:
-                    violation = None
-                    if float(image["top"]) < (57-self.top_offset):
-                        violation = Margin.TOP
-                    elif float(image["x0"]) < (71-self.left_offset):
-                        violation = Margin.LEFT
-                    elif Page.WIDTH.value-float(image["x1"]) < (71-self.right_offset):
-                        violation = Margin.RIGHT
-
-                    if violation:
-                        pages_image[i] += [(image, violation)]
-
-                # Parse texts
-                for j, word in enumerate(p.extract_words()):
-                    violation = None
-                    if float(word["top"]) < (57-self.top_offset):
-                        violation = Margin.TOP
-                    elif float(word["x0"]) < (71-self.left_offset):
-                        violation = Margin.LEFT
-                    elif Page.WIDTH.value-float(word["x1"]) < (71-self.right_offset):
-                        violation = Margin.RIGHT
-                        
-                    if violation:
-                        pages_text[i] += [(word, violation)]
+                # Parse images and texts into (x0, x1, top, bottom) arrays
+                regions = self._margin_regions(_box_array(p.images))
+                if regions:
+                    pages_image[i] = regions
+                regions = self._margin_regions(_box_array(p.extract_words()))
+                if regions:
+                    pages_text[i] = regions
             except:
                 perror.append(i+1)
 
@@ -171,34 +204,55 @@ class Formatter(object):
             pages = sorted(set(pages_text.keys()).union(set((pages_image.keys()))))
             for page in pages:
                 im = self.pdf.pages[page].to_image(resolution=150)
-                for (word, violation) in pages_text[page]:
+                for (violation, (x0, x1, top, bottom)) in pages_text.get(page, []):
 
-                    bbox = None
+                    self.logs[Error.MARGIN] += ["Text on page {} bleeds into the {} margin.".format(page+1, violation.value)]
                     if violation == Margin.RIGHT:
-                        self.logs[Error.MARGIN] += ["Text on page {} bleeds into the right margin.".format(page+1)]
-                        bbox = (Page.WIDTH.value-80, int(word["top"]-20), Page.WIDTH.value-20, int(word["bottom"]+20))
-                        im.draw_rect(bbox, fill=None, stroke="red", stroke_width=5)
+                        bbox = (Page.WIDTH.value-80, int(top-20), Page.WIDTH.value-20, int(bottom+20))
                     elif violation == Margin.LEFT:
-                        self.logs[Error.MARGIN] += ["Text on page {} bleeds into the left margin.".format(page+1)]
-                        bbox = (20, int(word["top"]-20), 80, int(word["bottom"]+20))
-                        im.draw_rect(bbox, fill=None, stroke="red", stroke_width=5)
-                    elif violation == Margin.TOP:
-                        self.logs[Error.MARGIN] += ["Text on page {} bleeds into the top margin.".format(page+1)]
-                        bbox = (20, int(word["top"]-20), 80, int(word["bottom"]+20))
-                        im.draw_rect(bbox, fill=None, stroke="red", stroke_width=5)
+                        bbox = (20, int(top-20), 80, int(bottom+20))
                     else:
-                        # TODO: add bottom margin violations
-                        pass
+                        bbox = (int(x0-20), int(top-20), int(x1+20), int(bottom+20))
+                    im.draw_rect(bbox, fill=None, stroke="red", stroke_width=5)
 
+                for (violation, bbox) in pages_image.get(page, []):
 
-                for (image, violation) in pages_image[page]:
+                    self.logs[Error.MARGIN] += ["An image on page {} bleeds into the {} margin.".format(page+1, violation.value)]
+                    x0, x1, top, bottom = bbox
+                    im.draw_rect((x0, top, x1, bottom), fill=None, stroke="red", stroke_width=5)
 
-                    self.logs[Error.MARGIN] += ["An image on page {} bleeds into the margin.".format(page+1)]
-                    bbox = (image["x0"], image["top"], image["x1"], image["bottom"])
-                    im.draw_rect(bbox, fill=None, stroke="red", stroke_width=5)
-                    
                 im.save("errors-{0}-page-{1}.png".format(*(self.number, page+1)), format="PNG")
-                #+ "Specific text: "+str([v for k, v in pages_text.values()])]
+
+
+    def _margin_regions(self, boxes):
+        '''Returns clustered (violation, (x0, x1, top, bottom)) regions of the
+        boxes that fall into a margin.'''
+
+        if not len(boxes):
+            return []
+        x0, x1, top, bottom = boxes.T
+        # 57 pixels (72ppi) = 2cm; 71 pixels (72ppi) = 2.5cm.
+        # Each box is assigned to the first margin it violates, in the
+        # order top, left, right, bottom.
+        masks = [
+            (Margin.TOP, top < (57-self.top_offset)),
+            (Margin.LEFT, x0 < (71-self.left_offset)),
+            (Margin.RIGHT, Page.WIDTH.value-x1 < (71-self.right_offset)),
+            (Margin.BOTTOM, Page.HEIGHT.value-bottom < (57-self.bottom_offset)),
+        ]
+        regions = []
+        seen = np.zeros(len(boxes), dtype=bool)
+        for violation, mask in masks:
+            mask &= ~seen
+            seen |= mask
+            if not mask.any():
+                continue
+            # cluster along the margin: vertically for left/right,
+            # horizontally for top/bottom
+            axis = 2 if violation in (Margin.LEFT, Margin.RIGHT) else 0
+            for region in _cluster_boxes(boxes[mask], axis):
+                regions.append((violation, tuple(region)))
+        return regions
 
                 
     def check_page_num(self, paper_type):
@@ -309,22 +363,83 @@ class Formatter(object):
 
 
 args = None
-def worker(pdf_path):
-    """ process one pdf """
-    Formatter().format_check(submission=pdf_path, paper_type=args.paper_type)
+def worker(item):
+    """ process one pdf, given as (label, path or bytes) """
+    label, source = item
+    Formatter().format_check(submission=label, paper_type=args.paper_type,
+                             pdf_file=archives.as_file(source))
+    return label
+
+
+def queue_job(label, payload):
+    """ process one pdf leased from a job queue """
+    return Formatter().format_check(submission=label, paper_type=payload["paper_type"],
+                                    pdf_file=payload["path"])
+
+
+def queue_worker(queue_spec):
+    """ process pdfs from a job queue until it is empty """
+    return jobqueue.work(jobqueue.open_queue(queue_spec), queue_job)
+
+
+def coordinate(queue_spec, paths, paper_type, report_file):
+    """ queue one job per pdf, wait for the workers, and merge their logs """
+    queue = jobqueue.open_queue(queue_spec)
+    # archives are unpacked into the queue's spool once, here, rather
+    # than by every worker for every member
+    staged = archives.stage(paths, queue.spool_dir)
+    # paths are made absolute for workers started in other directories;
+    # jobs of papers that were replaced since an earlier run are run again
+    results = jobqueue.coordinate(queue, ((label, {"paper_type": paper_type,
+                                                   "path": abspath(path),
+                                                   "signature": archives.signature(path)})
+                                          for label, path in staged))
+    report = {}
+    failed = 0
+    for label, (logs, error) in results.items():
+        if logs is None:
+            report[label] = {str(Error.PARSING): [f"Could not check the paper: {error}"]}
+            failed += 1
+        else:
+            report[label] = logs
+    json.dump(report, open(report_file, 'w'), indent=1)
+    with_errors = sum(1 for logs in report.values() if logs)
+    print(f"Checked {len(report)} papers ({failed} could not be checked); "
+          f"{with_errors} have errors or warnings. See {report_file}.")
 
 
 def main():
     global args
     parser = argparse.ArgumentParser()
-    parser.add_argument('submission_paths', metavar='file_or_dir', nargs='+',
+    parser.add_argument('submission_paths', metavar='file_dir_or_archive', nargs='*',
                         default=[])
     parser.add_argument('--paper_type', choices={"short", "long", "other"},
                         default='long')
     parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--queue', help="job queue (spool:DIR on a shared filesystem, "
+                        "or an SQLite file for one machine) to split the check across "
+                        "processes; without --worker, queues the papers and merges "
+                        "the results")
+    parser.add_argument('--worker', action='store_true',
+                        help="check papers from --queue until none are left")
+    parser.add_argument('--report', default='report.json',
+                        help="merged results of a --queue run")
     
     args = parser.parse_args()
 
+    if not args.worker and not args.submission_paths:
+        parser.error("no papers given")
+    if args.worker:
+        if not args.queue:
+            parser.error("--worker requires --queue")
+        if args.num_workers > 1:
+            from multiprocessing.pool import Pool
+            with Pool(args.num_workers) as p:
+                p.map(queue_worker, [args.queue] * args.num_workers)
+        else:
+            queue_worker(args.queue)
+        return
+
     # retrieve file paths
     paths = {join(root, file_name)
              for path in args.submission_paths
@@ -332,21 +447,48 @@ def main():
              for file_name in file_names}
     paths.update(args.submission_paths)
 
-    # retrieve files
+    # retrieve files; archives are only read if given on the command line
     fileset = sorted([p for p in paths if isfile(p) and p.endswith(".pdf")])
+    archiveset = sorted([p for p in args.submission_paths
+                         if isfile(p) and archives.is_archive(p)])
 
-    if not fileset:
+    if not fileset and not archiveset:
         print(f"No PDF files found in {paths}")
 
+    if args.queue:
+        coordinate(args.queue, fileset + archiveset,
+                   args.paper_type, args.report)
+        return
+
+    items = archives.iter_pdfs(fileset + archiveset)
     if args.num_workers > 1:
         from multiprocessing.pool import Pool
-        with Pool(args.num_workers) as p:
-            list(tqdm(p.imap(worker, fileset), total=len(fileset)))
+        from collections import deque
+
+        # submit papers from this thread, at most 4 per worker ahead of
+        # the results, so that only a few archive members are held in
+        # memory; a paper that fails to check is reported and skipped
+        def collect(label, result):
+            try:
+                result.get()
+            except Exception as e:
+                print(colored("Could not check {0}:".format(label), "red") + f" {e}")
+            progress.update()
+
+        window = deque()
+        total = None if archiveset else len(fileset)
+        with Pool(args.num_workers) as p, tqdm(total=total) as progress:
+            for item in items:
+                if len(window) >= 4 * args.num_workers:
+                    collect(*window.popleft())
+                window.append((item[0], p.apply_async(worker, (item,))))
+            while window:
+                collect(*window.popleft())
     else:
         # TODO: make the tqdm togglable
         #for submission in tqdm(fileset):
-        for submission in fileset:
-            worker(submission)
+        for item in items:
+            worker(item)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,425 @@
+'''
+Job queues for splitting a check across processes or machines.
+
+A coordinator puts one job per PDF in a queue; workers, possibly on
+several machines sharing a filesystem, lease jobs, run them and store
+their results in the queue; the coordinator waits for all jobs and
+merges the results into one report.
+
+A worker renews the lease of its job (a heartbeat) while it runs it.
+If a worker dies, its lease runs out and the job is leased again by
+another worker, up to max_attempts times.  Putting jobs is idempotent,
+so a coordinator can be restarted and will pick up where it left off;
+a job whose payload changed (e.g., because it carries the size and
+modification time of a PDF that was replaced) is run again.
+
+Queue backends implement JobQueue; neither of the two here needs
+outside services.  For workers on several machines, use SpoolQueue
+("spool:DIR"), which only needs atomic renames and exclusive file
+creation from the shared filesystem.  SQLiteQueue (a plain file path)
+relies on file locking, which some network filesystems (notably older
+NFS setups) do not implement reliably, so it is best kept to workers on
+one machine.
+'''
+
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class JobQueue(object):
+    '''Interface of a queue backend.  Jobs are identified by a key (e.g.,
+    the label of a PDF) and carry a JSON-serializable payload.
+
+    spool_dir is a directory next to the queue, for job inputs that are
+    too large for a payload (e.g., PDFs taken out of an archive).'''
+
+    spool_dir = None
+
+    def put(self, jobs):
+        '''Adds (key, payload) jobs.  Jobs already in the queue with the
+        same payload are kept; with another payload, they start over.'''
+        raise NotImplementedError
+
+    def lease(self, worker, seconds):
+        '''Returns (key, payload) of a job now leased to worker, or None.'''
+        raise NotImplementedError
+
+    def heartbeat(self, key, worker, seconds):
+        '''Extends worker's lease on the job; False if it was lost.'''
+        raise NotImplementedError
+
+    def complete(self, key, worker, result):
+        raise NotImplementedError
+
+    def fail(self, key, worker, error):
+        '''Gives the job back, to be retried unless out of attempts.'''
+        raise NotImplementedError
+
+    def counts(self, keys=None):
+        '''Returns a dict from state ("pending", "leased", "done",
+        "failed") to the number of jobs (of those in keys) in that state.'''
+        raise NotImplementedError
+
+    def results(self, keys=None):
+        '''Yields (key, result, error) for each finished job (in keys).'''
+        raise NotImplementedError
+
+
+class SQLiteQueue(JobQueue):
+    '''A queue in an SQLite database file.'''
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        # absolute, so that workers in other directories find the files
+        self.spool_dir = os.path.abspath(path) + '.spool'
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                key TEXT PRIMARY KEY,
+                payload TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT)''')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)')
+
+    def _db(self):
+        # sqlite3 connections may not be shared between threads, and the
+        # heartbeat runs in its own thread
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=60,
+                                                  isolation_level='IMMEDIATE')
+        return db
+
+    def put(self, jobs):
+        with self._db() as db:
+            db.executemany('''INSERT INTO jobs (key, payload) VALUES (?, ?)
+                              ON CONFLICT (key) DO UPDATE SET
+                                  payload = excluded.payload, state = 'pending',
+                                  worker = NULL, lease_until = NULL, attempts = 0,
+                                  result = NULL, error = NULL
+                              WHERE payload IS NOT excluded.payload''',
+                           ((key, json.dumps(payload, sort_keys=True))
+                            for key, payload in jobs))
+
+    def _expire(self, db, now):
+        # jobs whose last worker stopped sending heartbeats on their last
+        # attempt count as failed
+        db.execute('''UPDATE jobs SET state = 'failed', error = 'lease expired'
+                      WHERE state = 'leased' AND lease_until < ? AND attempts >= ?''',
+                   (now, self.max_attempts))
+
+    def lease(self, worker, seconds):
+        now = time.time()
+        with self._db() as db:
+            self._expire(db, now)
+            row = db.execute('''SELECT key, payload FROM jobs
+                                WHERE state = 'pending'
+                                   OR (state = 'leased' AND lease_until < ?)
+                                ORDER BY attempts, rowid LIMIT 1''', (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute('''UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?,
+                          attempts = attempts + 1 WHERE key = ?''',
+                       (worker, now + seconds, row[0]))
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, key, worker, seconds):
+        with self._db() as db:
+            cursor = db.execute('''UPDATE jobs SET lease_until = ?
+                                   WHERE key = ? AND worker = ? AND state = 'leased' ''',
+                                (time.time() + seconds, key, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, key, worker, result):
+        with self._db() as db:
+            db.execute('''UPDATE jobs SET state = 'done', result = ?, error = NULL
+                          WHERE key = ? AND worker = ? AND state = 'leased' ''',
+                       (json.dumps(result), key, worker))
+
+    def fail(self, key, worker, error):
+        with self._db() as db:
+            db.execute('''UPDATE jobs SET error = ?,
+                          state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+                          WHERE key = ? AND worker = ? AND state = 'leased' ''',
+                       (error, self.max_attempts, key, worker))
+
+    def counts(self, keys=None):
+        now = time.time()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        with self._db() as db:
+            self._expire(db, now)
+        for key, state, expired in db.execute(
+                'SELECT key, state, lease_until < ? FROM jobs', (now,)):
+            if keys is None or key in keys:
+                # an expired lease is as good as pending
+                counts['pending' if state == 'leased' and expired else state] += 1
+        return counts
+
+    def results(self, keys=None):
+        db = self._db()
+        for key, result, error in db.execute(
+                '''SELECT key, result, error FROM jobs
+                   WHERE state IN ('done', 'failed') ORDER BY key'''):
+            if keys is None or key in keys:
+                yield key, json.loads(result) if result is not None else None, error
+
+
+class SpoolQueue(JobQueue):
+    '''A queue in a directory, using only atomic file operations (rename
+    and exclusive create), so that it works on network filesystems
+    without reliable locking.
+
+    jobs/ holds a file per job, leases/ a file per running job whose
+    modification time is renewed by heartbeats, attempts/ a line per
+    attempt, and done/ and failed/ the results.  Files are named by a
+    hash of the job key.  Lease expiry assumes that the clocks of the
+    workers and the file server roughly agree.'''
+
+    STATES = ('jobs', 'leases', 'attempts', 'done', 'failed')
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.spool_dir = os.path.join(os.path.abspath(path), 'spool')
+        self.max_attempts = max_attempts
+        for state in self.STATES:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def _file(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _read(self, state, name):
+        try:
+            with open(self._file(state, name)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, state, name, text):
+        # write, then rename into place, so readers never see half a file
+        path = self._file(state, name)
+        tmp = f'{path}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def _remove(self, state, name):
+        try:
+            os.remove(self._file(state, name))
+        except FileNotFoundError:
+            pass
+
+    def _names(self, state):
+        # skips temporary files, which have a suffix
+        return {n for n in os.listdir(os.path.join(self.path, state)) if '.' not in n}
+
+    def _attempts(self, name):
+        text = self._read('attempts', name)
+        return len(text.splitlines()) if text else 0
+
+    def _finished(self, name):
+        return (os.path.exists(self._file('done', name))
+                or os.path.exists(self._file('failed', name)))
+
+    def _finish(self, state, name, key, result, error):
+        self._write(state, name, json.dumps({'key': key, 'result': result, 'error': error}))
+        self._remove('leases', name)
+
+    def _owns(self, name, worker):
+        return self._read('leases', name) == worker
+
+    def put(self, jobs):
+        for key, payload in jobs:
+            name = self._name(key)
+            job = json.dumps({'key': key, 'payload': payload}, sort_keys=True)
+            if self._read('jobs', name) == job:
+                continue
+            # a new or changed job starts over
+            self._write('jobs', name, job)
+            for state in ('leases', 'attempts', 'done', 'failed'):
+                self._remove(state, name)
+
+    def _expired(self, name, now):
+        '''Breaks the lease on a job if it ran out; returns True if the
+        job can be leased again.'''
+        path = self._file('leases', name)
+        try:
+            if os.stat(path).st_mtime >= now:
+                return False
+            # only one of the workers that see the expired lease gets to
+            # rename it away
+            broken = f'{path}.{socket.gethostname()}.{os.getpid()}.broken'
+            os.rename(path, broken)
+        except FileNotFoundError:
+            return True
+        os.remove(broken)
+        if self._attempts(name) >= self.max_attempts:
+            job = json.loads(self._read('jobs', name))
+            self._finish('failed', name, job['key'], None, 'lease expired')
+            return False
+        return True
+
+    def lease(self, worker, seconds):
+        now = time.time()
+        for name in sorted(self._names('jobs')):
+            if self._finished(name) or not self._expired(name, now):
+                continue
+            try:
+                fd = os.open(self._file('leases', name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(worker)
+            # the lease runs until its modification time
+            os.utime(self._file('leases', name), (now, now + seconds))
+            if self._finished(name):
+                # finished between the check above and the lease
+                self._remove('leases', name)
+                continue
+            with open(self._file('attempts', name), 'a') as f:
+                f.write(worker + '\n')
+            job = json.loads(self._read('jobs', name))
+            return job['key'], job['payload']
+        return None
+
+    def heartbeat(self, key, worker, seconds):
+        name = self._name(key)
+        if not self._owns(name, worker):
+            return False
+        now = time.time()
+        os.utime(self._file('leases', name), (now, now + seconds))
+        return True
+
+    def complete(self, key, worker, result):
+        name = self._name(key)
+        if self._owns(name, worker):
+            self._finish('done', name, key, result, None)
+
+    def fail(self, key, worker, error):
+        name = self._name(key)
+        if not self._owns(name, worker):
+            return
+        if self._attempts(name) >= self.max_attempts:
+            self._finish('failed', name, key, None, error)
+        else:
+            self._remove('leases', name)
+
+    def counts(self, keys=None):
+        now = time.time()
+        names = self._names('jobs')
+        if keys is not None:
+            names &= {self._name(key) for key in keys}
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for name in names:
+            if os.path.exists(self._file('done', name)):
+                counts['done'] += 1
+            elif os.path.exists(self._file('failed', name)):
+                counts['failed'] += 1
+            elif not os.path.exists(self._file('leases', name)):
+                counts['pending'] += 1
+            elif self._expired(name, now):
+                # an expired lease is as good as pending
+                counts['pending'] += 1
+            else:
+                counts['failed' if self._finished(name) else 'leased'] += 1
+        return counts
+
+    def results(self, keys=None):
+        names = None if keys is None else {self._name(key) for key in keys}
+        finished = []
+        for state in ('done', 'failed'):
+            for name in self._names(state):
+                if names is None or name in names:
+                    finished.append(json.loads(self._read(state, name)))
+        for job in sorted(finished, key=lambda job: job['key']):
+            yield job['key'], job['result'], job['error']
+
+
+BACKENDS = {
+    'sqlite': SQLiteQueue,
+    'spool': SpoolQueue,
+}
+
+
+def open_queue(spec, **kwargs):
+    '''Opens a queue from "backend:path" (e.g., "spool:/shared/checks"),
+    or a plain path for SQLite.'''
+    backend, sep, path = spec.partition(':')
+    if not sep or backend not in BACKENDS:
+        backend, path = 'sqlite', spec
+    return BACKENDS[backend](path, **kwargs)
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def coordinate(queue, jobs, poll=5, log=print):
+    '''Puts the jobs and waits until all of them are done or failed;
+    returns {key: (result, error)} for these jobs only, not for others
+    left in the queue by earlier runs.'''
+    keys = set()
+    def tracked():
+        for key, payload in jobs:
+            keys.add(key)
+            yield key, payload
+    queue.put(tracked())
+    while True:
+        counts = queue.counts(keys)
+        log(f"{counts['done']} done, {counts['failed']} failed, "
+            f"{counts['leased']} running, {counts['pending']} waiting")
+        if not counts['pending'] and not counts['leased']:
+            break
+        time.sleep(poll)
+    return {key: (result, error) for key, result, error in queue.results(keys)}
+
+
+def work(queue, func, worker=None, lease=300, poll=5, wait=False, log=print):
+    '''Runs func(key, payload) on leased jobs until the queue has none
+    left (or forever, if wait).  Returns the number of jobs run.'''
+    worker = worker or default_worker_id()
+    n_jobs = 0
+    while True:
+        job = queue.lease(worker, lease)
+        if job is None:
+            counts = queue.counts()
+            if not wait and not counts['pending'] and not counts['leased']:
+                return n_jobs
+            # other workers' jobs may still come back if they die
+            time.sleep(poll)
+            continue
+
+        key, payload = job
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(lease / 3):
+                if not queue.heartbeat(key, worker, lease):
+                    log(f'Lost the lease on {key}')
+                    return
+        heart = threading.Thread(target=beat, daemon=True)
+        heart.start()
+        try:
+            result = func(key, payload)
+        except Exception as e:
+            stop.set()
+            heart.join()
+            queue.fail(key, worker, f'{type(e).__name__}: {e}')
+            log(f'Failed {key}: {e}')
+        else:
+            stop.set()
+            heart.join()
+            queue.complete(key, worker, result)
+        n_jobs += 1
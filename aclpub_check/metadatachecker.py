@@ -4,34 +4,61 @@ import itertools
 import os
 import os.path
 import regex as re
-import unicodedata
 import textwrap
 
 import pandas as pd
 import pdfplumber
 import unidecode
 
+import archives
+import authors
 import googletools
+import jobqueue
 
 
 def _clean_str(value):
     if pd.isna(value):
         return ''
-    # uncurl all quotes
-    value = re.sub(r'[\u2018\u2019]', "'", value)
-    value = re.sub(r'[\u201C\u201D]', '"', value)
-    # use simple dashes
-    value = re.sub(r'[\u2013\u2014]', "-", value)
-    # not exactly sure why, but this has to be done iteratively
-    old_value = None
-    value = value.strip()
-    while old_value != value:
-        old_value = value
-        # strip space before accent; PDF seems to introduce these
-        value = re.sub(r'\p{Zs}+(\p{Mn})', r'\1', value)
-        # combine accents with characters
-        value = unicodedata.normalize('NFKC', value)
-    return value
+    return authors.clean(value)
+
+
+def _paper_pdfs(pdfs_dir, submission_ids, spool_dir=None):
+    """Yields (label, source) for the *_Paper.pdf files of the given
+    submissions in a directory or archive.  Other archive members are
+    skipped without being read.  With spool_dir, archive members are
+    staged there (see archives.stage) and source is the staged file."""
+    def keep(label):
+        return (archives.pdf_basename(label).endswith("_Paper.pdf")
+                and _submission_id(label) in submission_ids)
+
+    if archives.is_archive(pdfs_dir):
+        if spool_dir is not None:
+            pdfs = archives.stage([pdfs_dir], spool_dir, keep)
+        else:
+            pdfs = archives.iter_archive_pdfs(pdfs_dir, keep)
+    else:
+        pdfs = ((os.path.join(root, filename),) * 2
+                for root, _, filenames in os.walk(pdfs_dir)
+                for filename in filenames)
+    for label, source in pdfs:
+        if keep(label):
+            yield label, source
+
+
+def _submission_id(label):
+    submission_id, _ = archives.pdf_basename(label).split("_", 1)
+    return int(submission_id)
+
+
+def _first_page_text(source):
+    with pdfplumber.open(archives.as_file(source)) as pdf:
+        # assumes metadata can be found in the first 500 characters
+        text = pdf.pages[0].extract_text()[:500]
+    return _clean_str(text)
+
+
+def queue_job(label, payload):
+    return _first_page_text(payload['path'])
 
 
 def yield_author_problems(names, text):
@@ -102,20 +129,35 @@ def check_metadata(
         sheet_id,
         id_column,
         problem_column,
-        post=False):
+        post=False,
+        queue=None):
+
+    df = pd.read_csv(submissions_path, keep_default_na=False)
+    submission_ids = set(df["Submission ID"])
 
-    # map submission IDs to PDF paths
-    id_to_pdf = {}
-    for root, _, filenames in os.walk(pdfs_dir):
-        for filename in filenames:
-            if filename.endswith("_Paper.pdf"):
-                submission_id, _ = filename.split("_", 1)
-                id_to_pdf[int(submission_id)] = os.path.join(root, filename)
+    # map the IDs in the spreadsheet to the start of their PDF's first
+    # page; an archive is read once, in order, without extracting it to
+    # disk, and PDFs of other submissions are not opened
+    id_to_text = {}
+    if queue is None:
+        for label, source in _paper_pdfs(pdfs_dir, submission_ids):
+            id_to_text[_submission_id(label)] = _first_page_text(source)
+    else:
+        # let workers (see --worker) extract the texts
+        queue = jobqueue.open_queue(queue)
+        pdfs = _paper_pdfs(pdfs_dir, submission_ids, queue.spool_dir)
+        # absolute paths, for workers started in other directories
+        results = jobqueue.coordinate(queue, ((label, {'path': os.path.abspath(path),
+                                                       'signature': archives.signature(path)})
+                                              for label, path in pdfs))
+        for label, (text, error) in results.items():
+            if error is not None:
+                raise ValueError(f'could not read {label}: {error}')
+            id_to_text[_submission_id(label)] = text
 
     id_to_sheet_row = {}
     problems = collections.defaultdict(lambda: collections.defaultdict(list))
 
-    df = pd.read_csv(submissions_path, keep_default_na=False)
     for index, row in df.iterrows():
         submission_id = row["Submission ID"]
         title = _clean_str(row["Title"])
@@ -130,12 +172,7 @@ def check_metadata(
         # row in the spreadsheet is 1-based and first row is the header
         id_to_sheet_row[submission_id] = index + 2
 
-        # open the PDF
-        pdf_path = id_to_pdf[submission_id]
-        pdf = pdfplumber.open(pdf_path)
-
-        # assumes metadata can be found in the first 500 characters
-        text = _clean_str(pdf.pages[0].extract_text()[:500])
+        text = id_to_text[submission_id]
 
         # collect all authors and their affiliations
         names = []
@@ -205,12 +242,26 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--submissions', dest='submissions_path',
                         default='Submission_Information.csv')
-    parser.add_argument('--pdfs', dest='pdfs_dir', default='final')
+    parser.add_argument('--pdfs', dest='pdfs_dir', default='final',
+                        help='directory or .tgz/.zip archive of final PDFs')
     parser.add_argument('--post', action='store_true')
     parser.add_argument('--spreadsheet-id',
                         default='1lQyGZNBEBwukf8-mgPzIH57xUX9y4o2OUCzpEvNpW9A')
     parser.add_argument('--sheet-id', default='Sheet1')
     parser.add_argument('--id-column', default='A')
     parser.add_argument('--problem-column', default='E')
+    parser.add_argument('--queue',
+                        help='job queue (spool:DIR on a shared filesystem, '
+                             'or an SQLite file for one machine) for reading '
+                             'the PDFs in several processes; start the '
+                             'workers with --worker')
+    parser.add_argument('--worker', action='store_true',
+                        help='read PDFs from --queue until none are left')
     args = parser.parse_args()
-    check_metadata(**vars(args))
+    if args.worker:
+        if not args.queue:
+            parser.error('--worker requires --queue')
+        jobqueue.work(jobqueue.open_queue(args.queue), queue_job)
+    else:
+        del args.worker
+        check_metadata(**vars(args))
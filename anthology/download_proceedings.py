@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+'''
+Downloads proceedings for all volumes in a conference to a data/ directory.
+
+usage:   download_proceedings.py [-j N] [--manifest SHA256SUMS] start_urls.txt
+
+Like download-proceedings.sh, but volumes are downloaded concurrently
+over at most N connections, and each proceedings.tgz is extracted into
+data/<acronym>/ as it arrives rather than in a second pass.
+
+Downloads go to data/<acronym>/proceedings.tgz.part and are resumed with
+an HTTP range request when the script is run again after an interruption
+(or after a connection stalls for longer than --timeout seconds).
+The bytes already on disk are replayed into the extractor first, so the
+extracted tree is always complete.  The tarball is extracted into
+data/<acronym>.extracting/ and moved into data/<acronym>/ only once it
+is complete and matches the manifest; a rejected tarball leaves nothing
+behind in data/<acronym>/.  If the server does not honor the range
+request, the download restarts from zero.
+
+The manifest, if given, is in sha256sum format, with either the acronym
+or the full URL of the tarball as the name:
+
+  3a7bd3e2360a3d29eea436fcfb7e44c735d117c42d1c1835420b6b9942dd4f1b  papers
+
+A finished tarball is checked against it and rejected on mismatch.  The
+checksum of every finished download is written to proceedings.tgz.sha256,
+and volumes whose proceedings.tgz is already complete (and matches the
+manifest) are skipped.
+'''
+
+import argparse
+import hashlib
+import http.client
+import os
+import shutil
+import ssl
+import sys
+import tarfile
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+CHUNK_SIZE = 1 << 16
+# seconds to wait for a connection or for the next block of data
+TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    pass
+
+
+def read_manifest(path):
+    '''Returns a dict from acronym or URL to sha256 hex digest.'''
+    manifest = {}
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            digest, name = line.split(None, 1)
+            manifest[name.lstrip('*')] = digest.lower()
+    return manifest
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class _ResumingStream(object):
+    '''A read-only file object over a tarball being downloaded.
+
+    Replays the bytes already in the .part file, then reads the rest from
+    the HTTP response while appending it to the .part file, so the whole
+    archive is hashed and can be extracted in one pass.'''
+
+    def __init__(self, part_path, response, offset):
+        self.digest = hashlib.sha256()
+        self.local = open(part_path, 'rb') if offset else None
+        self.response = response
+        self.out = open(part_path, 'ab' if offset else 'wb')
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = CHUNK_SIZE
+        if self.local is not None:
+            data = self.local.read(size)
+            if data:
+                self.digest.update(data)
+                return data
+            self.local.close()
+            self.local = None
+        data = self.response.read(size)
+        if data:
+            self.out.write(data)
+            self.digest.update(data)
+        return data
+
+    def drain(self):
+        '''Reads whatever the extractor left (e.g., tar padding).'''
+        while self.read(CHUNK_SIZE):
+            pass
+
+    def close(self):
+        if self.local is not None:
+            self.local.close()
+        self.out.close()
+
+
+def _open(url, offset, insecure, timeout=TIMEOUT):
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header('Range', f'bytes={offset}-')
+    context = ssl._create_unverified_context() if insecure else None
+    response = urllib.request.urlopen(request, context=context, timeout=timeout)
+    if offset and response.status != 206:
+        # server ignored the range request; start over
+        offset = 0
+    return response, offset
+
+
+def _extract(stream, dest_dir):
+    with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(dest_dir, filter='data')
+        else:
+            for member in tar:
+                if member.name.startswith('/') or '..' in member.name.split('/'):
+                    raise DownloadError(f'unsafe path in archive: {member.name}')
+                tar.extract(member, dest_dir)
+
+
+def _move_into(src_dir, dest_dir):
+    '''Moves the entries of src_dir into dest_dir, replacing those of the
+    same name, and removes src_dir.'''
+    for name in os.listdir(src_dir):
+        dest = os.path.join(dest_dir, name)
+        if os.path.isdir(dest) and not os.path.islink(dest):
+            shutil.rmtree(dest)
+        os.replace(os.path.join(src_dir, name), dest)
+    os.rmdir(src_dir)
+
+
+def fetch(url, data_dir='data', manifest=None, insecure=False, timeout=TIMEOUT, log=print):
+    '''Downloads and extracts <url>/pub/aclpub/proceedings.tgz into
+    data_dir/<acronym>; returns the acronym.  A stalled connection fails
+    with DownloadError after timeout seconds and is resumed on the next run.'''
+    manifest = manifest or {}
+    acronym = os.path.basename(url.rstrip('/'))
+    tgz_url = url.rstrip('/') + '/pub/aclpub/proceedings.tgz'
+    dest_dir = os.path.join(data_dir, acronym)
+    tgz_path = os.path.join(dest_dir, 'proceedings.tgz')
+    part_path = tgz_path + '.part'
+    expected = manifest.get(tgz_url) or manifest.get(url) or manifest.get(acronym)
+
+    if os.path.exists(tgz_path) and os.path.getsize(tgz_path):
+        if expected is None or sha256_file(tgz_path) == expected:
+            log(f'* Already have {acronym}, skipping')
+            return acronym
+        log(f'* Checksum mismatch for existing {acronym}, downloading again')
+        os.remove(tgz_path)
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    try:
+        try:
+            response, offset = _open(tgz_url, offset, insecure, timeout)
+        except urllib.error.HTTPError as e:
+            if e.code != 416 or not offset:
+                raise
+            # range not satisfiable: the .part file may be the whole file
+            # or garbage; start over to be sure
+            response, offset = _open(tgz_url, 0, insecure, timeout)
+    except urllib.error.HTTPError as e:
+        raise DownloadError(f'{tgz_url}: {e}') from e
+    except urllib.error.URLError as e:
+        raise DownloadError(f'{tgz_url}: {e.reason}') from e
+    except (OSError, http.client.HTTPException) as e:
+        # e.g., a timeout while reading the response headers
+        raise DownloadError(f'{tgz_url}: {e}') from e
+
+    os.makedirs(dest_dir, exist_ok=True)
+    # extract next to dest_dir and move the tree into place once it has
+    # passed the checksum; anything left from an interrupted run is
+    # extracted again from the replayed bytes
+    extract_dir = dest_dir.rstrip(os.sep) + '.extracting'
+    if os.path.exists(extract_dir):
+        shutil.rmtree(extract_dir)
+
+    log(f'Downloading {tgz_url} -> {dest_dir}' + (f' (resuming at {offset} bytes)' if offset else ''))
+    stream = _ResumingStream(part_path, response, offset)
+    try:
+        with response:
+            _extract(stream, extract_dir)
+            stream.drain()
+    except (tarfile.TarError, EOFError, OSError, http.client.HTTPException) as e:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        raise DownloadError(f'{tgz_url}: {e}') from e
+    finally:
+        stream.close()
+
+    digest = stream.digest.hexdigest()
+    if expected is not None and digest != expected:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        os.remove(part_path)
+        raise DownloadError(f'{tgz_url}: checksum {digest} does not match manifest {expected}')
+    os.makedirs(extract_dir, exist_ok=True)
+    _move_into(extract_dir, dest_dir)
+    os.replace(part_path, tgz_path)
+    with open(tgz_path + '.sha256', 'w') as f:
+        f.write(f'{digest}  proceedings.tgz\n')
+    return acronym
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Downloads proceedings for all volumes in a conference to a data/ directory.')
+    parser.add_argument('start_urls_file')
+    parser.add_argument('-j', '--num_workers', type=int, default=4,
+                        help='maximum number of concurrent downloads')
+    parser.add_argument('--manifest', help='sha256sum-style checksum manifest')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--secure', dest='insecure', action='store_false',
+                        help='verify TLS certificates (curl --insecure was used before)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help='seconds to wait on a stalled connection before giving up '
+                             '(the download is resumed on the next run)')
+    args = parser.parse_args()
+
+    with open(args.start_urls_file) as f:
+        urls = [line.strip() for line in f if line.strip()]
+    manifest = read_manifest(args.manifest) if args.manifest else {}
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.num_workers) as pool:
+        futures = {pool.submit(fetch, url, args.data_dir, manifest, args.insecure,
+                               args.timeout): url
+                   for url in urls}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except DownloadError as e:
+                print(f'Failed: {e}', file=sys.stderr)
+                failed += 1
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
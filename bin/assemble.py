@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+'''
+assemble the proceedings volume directly from the final paper PDFs
+
+usage:   assemble.py [--db db] [-o papers.pdf] [--front front.pdf]
+                     [--start-page N] [--venue TEXT] [--copyright TEXT]
+
+For each paper in the db file (in order), stamps a page number on every
+page and the citation footer (venue, pages, copyright) on the first
+page, then concatenates the stamped papers into one volume with a
+bookmark per paper.  This replaces the allpapers.tex / pdflatex round
+trip of "manage-db.pl join-papers" for building the papers part of
+book.pdf.  A page-offset table (paper ID, first page, last page, file,
+title) is written next to the volume.
+
+Each stamped paper is cached in the cache directory under a hash of
+the paper PDF and everything that is stamped on it.  When one paper
+changes, only that paper is stamped again, and the volume is spliced
+together from the cache.  Papers after it are stamped again only if
+their page numbers shift, i.e. if the changed paper's length changes.
+
+The "M:" margin offsets of the db file ("M: dx dy", in mm) are applied
+by shifting the page contents; further includepdf options are ignored.
+
+Text is set in the standard Times-Roman font and centered using an
+approximate character width.
+
+Uses pdfrw library:
+https://github.com/pmaupin/pdfrw
+
+'''
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from pdfrw import PdfReader, PdfWriter, PdfDict, PdfName, PdfString, IndirectPdfDict
+
+from order import read_db
+
+
+# 1mm in PDF points
+MM = 72 / 25.4
+FONT_SIZE = 8
+# average Times-Roman advance width, as a fraction of the font size
+CHAR_WIDTH = 0.45
+# bump this when the stamping below changes, to invalidate the cache
+STAMP_VERSION = '1'
+
+
+def _pdf_text(text):
+    '''Escapes text for a PDF string in a WinAnsiEncoding font.'''
+    text = text.encode('cp1252', errors='replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _centered(text, x, y, size=FONT_SIZE):
+    width = len(text) * size * CHAR_WIDTH
+    return 'BT /AclpubF1 %d Tf %.2f %.2f Td (%s) Tj ET' % (size, x - width / 2, y, _pdf_text(text))
+
+
+def pages_text(first, last):
+    return f'page {first}' if first == last else f'pages {first}–{last}'
+
+
+class Stamp(object):
+    '''What is stamped on one paper; its key identifies the cached result.'''
+
+    def __init__(self, pdf_path, first_page, venue, copyright, offset=(0, 0)):
+        self.pdf_path = pdf_path
+        self.first_page = first_page
+        self.venue = venue
+        self.copyright = copyright
+        self.offset = offset
+
+    def key(self):
+        digest = hashlib.sha256()
+        with open(self.pdf_path, 'rb') as pdf:
+            for block in iter(lambda: pdf.read(1 << 20), b''):
+                digest.update(block)
+        params = (STAMP_VERSION, self.first_page, self.venue, self.copyright, self.offset)
+        digest.update(repr(params).encode('utf-8'))
+        return digest.hexdigest()
+
+    def apply(self, out_path):
+        '''Writes the stamped paper to out_path; returns its page count.'''
+        pdf = PdfReader(self.pdf_path)
+        font = PdfDict(Type=PdfName.Font, Subtype=PdfName.Type1,
+                       BaseFont=PdfName('Times-Roman'), Encoding=PdfName.WinAnsiEncoding)
+        n_pages = len(pdf.pages)
+        last_page = self.first_page + n_pages - 1
+        for i, page in enumerate(pdf.pages):
+            x0, y0, x1, _ = [float(x) for x in page.inheritable.MediaBox]
+            center = (x0 + x1) / 2
+            lines = [_centered(str(self.first_page + i), center, y0 + 17 * MM)]
+            if i == 0:
+                footer = f'{self.venue}, {pages_text(self.first_page, last_page)}'
+                lines.append(_centered(footer, center, y0 + 13 * MM))
+                if self.copyright:
+                    lines.append(_centered(self.copyright, center, y0 + 10 * MM))
+
+            # wrap the original contents so that their graphics state
+            # (and the margin offset) does not leak into the stamp
+            contents = page.Contents
+            if contents is None:
+                contents = []
+            elif isinstance(contents, PdfDict):
+                contents = [contents]
+            dx, dy = self.offset
+            begin = IndirectPdfDict(stream='q 1 0 0 1 %.2f %.2f cm' % (dx * MM, dy * MM))
+            end = IndirectPdfDict(stream='Q\n' + '\n'.join(lines))
+            page.Contents = [begin] + list(contents) + [end]
+
+            resources = page.inheritable.Resources
+            resources = PdfDict(resources) if resources is not None else PdfDict()
+            fonts = PdfDict(resources.Font) if resources.Font is not None else PdfDict()
+            fonts.AclpubF1 = font
+            resources.Font = fonts
+            page.Resources = resources
+
+        PdfWriter(out_path, trailer=pdf).write()
+        return n_pages
+
+
+def _outline(writer, entries):
+    '''Adds one bookmark per (title, page index) entry to the writer.'''
+    outlines = IndirectPdfDict(Type=PdfName.Outlines)
+    items = []
+    for title, index in entries:
+        item = IndirectPdfDict(Title=PdfString.from_unicode(title), Parent=outlines,
+                               Dest=[writer.pagearray[index], PdfName.Fit])
+        if items:
+            items[-1].Next = item
+            item.Prev = items[-1]
+        items.append(item)
+    if items:
+        outlines.First = items[0]
+        outlines.Last = items[-1]
+        outlines.Count = len(items)
+        writer.trailer.Root.Outlines = outlines
+        writer.trailer.Root.PageMode = PdfName.UseOutlines
+
+
+def _offset(margins, paper_id):
+    '''Parses an "M:" db field ("dx dy [options]", in mm).'''
+    if not margins:
+        return 0, 0
+    parts = margins.split(None, 2)
+    try:
+        dx, dy = int(parts[0]), int(parts[1])
+    except (IndexError, ValueError):
+        sys.exit(f"buggy margin definition '{margins}' for paper {paper_id}")
+    if len(parts) > 2:
+        print(f'Ignoring includepdf options "{parts[2]}" for paper {paper_id}',
+              file=sys.stderr)
+    return dx, dy
+
+
+def assemble(db, output, front=None, start_page=1, venue='', copyright='',
+             cache_dir='.assemble-cache', offsets_path=None):
+    '''Stamps and concatenates the papers in db into output.'''
+    os.makedirs(cache_dir, exist_ok=True)
+    start = time.time()
+    page = start_page
+    stamped, rows, bookmarks = [], [], []
+    n_restamped = 0
+    for record in read_db(db):
+        if 'F' not in record:
+            continue
+        paper_id = record.get('P', ['?'])[0]
+        title = record.get('T', [''])[0]
+        stamp = Stamp(record['F'][0], page, venue, copyright,
+                      _offset(record.get('M', [''])[0], paper_id))
+        path = os.path.join(cache_dir, stamp.key() + '.pdf')
+        if os.path.exists(path):
+            n_pages = len(PdfReader(path).pages)
+        else:
+            # write to a temporary name so an interrupted run leaves no
+            # half-written file in the cache
+            n_pages = stamp.apply(path + '.tmp')
+            os.replace(path + '.tmp', path)
+            n_restamped += 1
+        if 'L' in record and int(record['L'][0]) != n_pages:
+            print(f'Paper {paper_id}: db says {record["L"][0]} pages, '
+                  f'{record["F"][0]} has {n_pages}', file=sys.stderr)
+        stamped.append(path)
+        rows.append((paper_id, page, page + n_pages - 1, record['F'][0], title))
+        page += n_pages
+
+    writer = PdfWriter(output)
+    if front:
+        writer.addpages(PdfReader(front).pages)
+    for path, (paper_id, first, last, _, title) in zip(stamped, rows):
+        bookmarks.append((title or paper_id, len(writer.pagearray)))
+        writer.addpages(PdfReader(path).pages)
+    _outline(writer, bookmarks)
+    writer.write()
+
+    if offsets_path is None:
+        offsets_path = os.path.splitext(output)[0] + '-offsets.tsv'
+    with open(offsets_path, 'w', encoding='utf-8') as table:
+        table.write('id\tfirst\tlast\tfile\ttitle\n')
+        for row in rows:
+            table.write('\t'.join(str(x) for x in row) + '\n')
+
+    elapsed = time.time() - start
+    print(f'Assembled {len(rows)} papers ({page - start_page} pages, '
+          f'{n_restamped} stamped, {len(rows) - n_restamped} from cache) '
+          f'into {output} in {elapsed:.1f}s', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Assembles the proceedings volume '
+                                                 'from the final paper PDFs.')
+    parser.add_argument('--db', default='db')
+    parser.add_argument('-o', dest='output', default='papers.pdf')
+    parser.add_argument('--front', help='front matter pdf to put before the papers')
+    parser.add_argument('--start-page', type=int, default=1,
+                        help='page number of the first page of the first paper')
+    parser.add_argument('--venue', default='Proceedings',
+                        help='e.g., "Proceedings of the 58th Annual Meeting of the '
+                             'Association for Computational Linguistics"')
+    parser.add_argument('--copyright', default='',
+                        help='e.g., "July 5-10, 2020. ©2020 Association for '
+                             'Computational Linguistics"')
+    parser.add_argument('--cache-dir', default='.assemble-cache')
+    parser.add_argument('--offsets', dest='offsets_path',
+                        help='page-offset table (default: OUTPUT-offsets.tsv)')
+    args = parser.parse_args()
+    assemble(**vars(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+
+'''
+parse and verify an ACLPUB order file
+
+usage:   order.py [--db db] [--json schedule.json] < order
+
+Reads the order file as a stream and builds a schedule model of days,
+sessions, timed events and papers.  Reports
+
+  * lines that are not in the order file format,
+  * papers in one session whose time slots overlap (papers sharing
+    the same slot, as in poster sessions, and events are allowed),
+  * sessions on the same day that overlap (a warning, since parallel
+    tracks are allowed),
+  * paper IDs that appear more than once,
+  * paper IDs that are not in the db file (with --db), and papers
+    in the db file that are missing from the order (a warning).
+
+Overlaps are found by sorting each day's (or session's) time intervals
+once and sweeping over them, and each group of overlapping slots is
+reported once, so checking a main conference program stays close to
+linear in its size.
+
+With --json, the parsed schedule is written out so that other tools
+(e.g., program generators) can use it instead of re-parsing the order
+file.  The exit status is the number of errors found.
+
+The format is described in docs/order.md:
+
+  * Thursday, June 13, 2013
+  + 9:15--9:30 Opening Remarks
+  = Session 1
+  8 9:30--10:00 # A Semantic Evaluation of Machine Translation Lexical Choice
+  16  # A paper without a time slot
+
+'''
+
+import argparse
+import datetime
+import json
+import re
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+TIMERANGE_REGEXP = re.compile(r'^(\d{1,2}):(\d\d)--(\d{1,2}):(\d\d)$')
+DAY_REGEXP = re.compile(r'^\*\s+(\w+),\s+(\w+)\s+(\d{1,2}),\s+(\d{4})\s*$')
+PAPER_REGEXP = re.compile(r'^(\d+)(?:\s+(\S+))?\s*$')
+EVENT_REGEXP = re.compile(r'^([+!])\s+(\S+)\s+(.*?)\s*$')
+HEADER_REGEXP = re.compile(r'^=\s*(?:(\d+:\d+--\d+:\d+)\s+)?(.*?)\s*$')
+
+DAYS = 'Monday Tuesday Wednesday Thursday Friday Saturday Sunday'.split(' ')
+MONTHS = 'January February March April May June July August September October November December'.split(' ')
+
+
+@dataclass
+class Problem:
+    lineno: int
+    message: str
+    error: bool = True
+
+    def __str__(self):
+        kind = 'Error' if self.error else 'Warning'
+        where = f' on line {self.lineno}' if self.lineno else ''
+        return f'{kind}{where}: {self.message}'
+
+
+@dataclass
+class Event:
+    '''A timed item that is not a paper ("+" or "!" lines).'''
+    lineno: int
+    kind: str
+    start: int
+    end: int
+    title: str
+
+
+@dataclass
+class Paper:
+    '''A paper line; start and end are None if it has no time slot.'''
+    lineno: int
+    paper_id: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+    title: str = ''
+
+
+@dataclass
+class Session:
+    '''Items under a "=" header, or before the first header of a day.'''
+    lineno: int
+    title: Optional[str] = None
+    start: Optional[int] = None
+    end: Optional[int] = None
+    items: List[object] = field(default_factory=list)
+
+    def span(self):
+        '''The (start, end) of the session in minutes, or None if untimed.'''
+        if self.start is not None:
+            return self.start, self.end
+        times = [(item.start, item.end) for item in self.items
+                 if item.start is not None]
+        if not times:
+            return None
+        return min(s for s, _ in times), max(e for _, e in times)
+
+
+@dataclass
+class Day:
+    '''A "*" line and its sessions; date is None before the first day.'''
+    lineno: int
+    date: Optional[datetime.date] = None
+    sessions: List[Session] = field(default_factory=list)
+
+
+@dataclass
+class Schedule:
+    days: List[Day] = field(default_factory=list)
+
+    def papers(self) -> Iterator[Paper]:
+        for day in self.days:
+            for session in day.sessions:
+                for item in session.items:
+                    if isinstance(item, Paper):
+                        yield item
+
+    def to_json(self):
+        def default(o):
+            if isinstance(o, datetime.date):
+                return o.isoformat()
+            raise TypeError(o)
+        days = []
+        for day in self.days:
+            d = asdict(day)
+            for s, session in zip(d['sessions'], day.sessions):
+                for i, item in zip(s['items'], session.items):
+                    i['type'] = type(item).__name__.lower()
+            days.append(d)
+        return json.dumps({'days': days}, default=default, indent=1)
+
+
+def parse_timerange(text):
+    '''Parses "HH:MM--HH:MM" into minutes since midnight, or returns None.'''
+    match = TIMERANGE_REGEXP.match(text)
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(x) for x in match.groups())
+    if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59:
+        return None
+    return h1 * 60 + m1, h2 * 60 + m2
+
+
+def format_time(minutes):
+    return '%d:%02d' % divmod(minutes, 60)
+
+
+class OrderParser(object):
+    '''Builds a Schedule one order-file line at a time.'''
+
+    def __init__(self):
+        self.schedule = Schedule()
+        self.problems = []
+        self.day = None
+        self.session = None
+
+    def error(self, lineno, message, error=True):
+        self.problems.append(Problem(lineno, message, error))
+
+    def feed(self, lineno, line):
+        line = line.rstrip()
+
+        # Skip blanks and comments
+        if line.strip() == '' or line.startswith('#'):
+            return
+
+        if line.startswith('*'):
+            self._day(lineno, line)
+        elif line.startswith('='):
+            self._header(lineno, line)
+        elif line.startswith('+') or line.startswith('!'):
+            self._event(lineno, line)
+        elif line[0].isdigit():
+            self._paper(lineno, line)
+        else:
+            self.error(lineno, f'unrecognized line "{line}"; expected a line '
+                               f'starting with "*", "=", "+", "!" or a paper ID')
+
+    def _current_day(self, lineno):
+        if self.day is None:
+            self.day = Day(lineno)
+            self.schedule.days.append(self.day)
+        return self.day
+
+    def _current_session(self, lineno):
+        if self.session is None:
+            self._current_day(lineno)
+            self.session = Session(lineno)
+            self.day.sessions.append(self.session)
+        return self.session
+
+    def _day(self, lineno, line):
+        match = DAY_REGEXP.match(line)
+        date = None
+        if not match:
+            self.error(lineno, f'found "{line}", expected "* DAY, MONTH DATE, YEAR", '
+                               f'e.g., "* Thursday, June 26, 2014"')
+        else:
+            day, month, dom, year = match.groups()
+            if day not in DAYS:
+                self.error(lineno, f'unknown day "{day}"')
+            elif month not in MONTHS:
+                self.error(lineno, f'unknown month "{month}"')
+            else:
+                try:
+                    date = datetime.date(int(year), MONTHS.index(month) + 1, int(dom))
+                except ValueError:
+                    self.error(lineno, f'invalid date "{month} {dom}, {year}"')
+                if date is not None and DAYS[date.weekday()] != day:
+                    self.error(lineno, f'{date:%B %d, %Y} is a '
+                                       f'{DAYS[date.weekday()]}, not a {day}')
+        self.day = Day(lineno, date)
+        self.session = None
+        self.schedule.days.append(self.day)
+
+    def _header(self, lineno, line):
+        match = HEADER_REGEXP.match(line)
+        timerange, title = match.groups()
+        self.session = Session(lineno, title)
+        self._current_day(lineno).sessions.append(self.session)
+        if timerange or re.match(r'.*\d:\d.*', title):
+            self.error(lineno, 'header lines should not contain time ranges; use '
+                               '"=" for headers (display only) and "+" for timed '
+                               'events', error=False)
+        if timerange:
+            times = parse_timerange(timerange)
+            if times is None:
+                self.error(lineno, f'found "{timerange}", expected HH:MM--HH:MM (time '
+                                   f'range, 24-hour format, two dashes), e.g., 12:30--13:30')
+            else:
+                self.session.start, self.session.end = times
+
+    def _event(self, lineno, line):
+        match = EVENT_REGEXP.match(line)
+        if not match:
+            self.error(lineno, f'found "{line}", expected "+ HH:MM--HH:MM EVENT TITLE"')
+            return
+        kind, timerange, title = match.groups()
+        times = parse_timerange(timerange)
+        if times is None:
+            self.error(lineno, f'found "{timerange}", expected HH:MM--HH:MM (time '
+                               f'range, 24-hour format, two dashes), e.g., 12:30--13:30')
+            return
+        self._current_session(lineno).items.append(Event(lineno, kind, *times, title))
+
+    def _paper(self, lineno, line):
+        # anything after "#" is ignored (the paper title, by convention)
+        text, _, title = line.partition('#')
+        match = PAPER_REGEXP.match(text.strip())
+        if not match:
+            self.error(lineno, f'found "{line}", expected "ID HH:MM--HH:MM # TITLE"')
+            return
+        paper_id, timerange = match.groups()
+        paper = Paper(lineno, paper_id, title=title.strip())
+        if timerange and timerange != 'none':
+            times = parse_timerange(timerange)
+            if times is None:
+                self.error(lineno, f'found "{timerange}", expected HH:MM--HH:MM (time '
+                                   f'range, 24-hour format, two dashes), e.g., 12:30--13:30')
+            else:
+                paper.start, paper.end = times
+        self._current_session(lineno).items.append(paper)
+
+
+def parse_order(lines: Iterable[str]) -> Tuple[Schedule, List[Problem]]:
+    '''Parses order file lines into a Schedule and a list of format problems.'''
+    parser = OrderParser()
+    for lineno, line in enumerate(lines, 1):
+        parser.feed(lineno, line)
+    return parser.schedule, parser.problems
+
+
+class IntervalIndex(object):
+    '''Time intervals sorted by start, for finding groups that overlap.'''
+
+    def __init__(self, intervals):
+        # intervals are (start, end, value) with end > start
+        self.intervals = sorted(intervals, key=lambda x: (x[0], x[1]))
+
+    def groups(self):
+        '''Yields the values of each group of two or more intervals that
+        are chained together by overlaps, in order of start time.
+
+        One sweep over the intervals by start time, keeping the latest end
+        seen so far, so the cost is O(n log n) however many intervals
+        overlap each other (e.g., in a poster session).'''
+        group, group_end = [], None
+        for start, end, value in self.intervals:
+            if group and start >= group_end:
+                if len(group) > 1:
+                    yield group
+                group = []
+            if not group:
+                group_end = end
+            group.append(value)
+            group_end = max(group_end, end)
+        if len(group) > 1:
+            yield group
+
+
+def read_db(path):
+    '''Returns the records of a db file as dicts from field letter (e.g.,
+    "P" for the paper ID, "F" for the PDF file) to a list of values.'''
+    records, record = [], {}
+    with open(path, encoding='utf-8') as db:
+        for line in db:
+            line = line.rstrip()
+            match = re.match(r'^(.):\s*(.+)', line)
+            if match:
+                record.setdefault(match.group(1), []).append(match.group(2))
+            elif not line.strip() and record:
+                records.append(record)
+                record = {}
+    if record:
+        records.append(record)
+    return records
+
+
+def read_db_ids(path):
+    '''Returns the paper IDs ("P:" lines) in a db file, in order.'''
+    return [record['P'][0] for record in read_db(path) if 'P' in record]
+
+
+def check_schedule(schedule, db_ids=None):
+    '''Returns the problems with a parsed schedule: overlaps and bad IDs.'''
+    problems = []
+
+    for day in schedule.days:
+        # overlapping papers within a session; papers in the same slot
+        # (e.g., posters) and "+"/"!" events alongside papers are fine
+        for session in day.sessions:
+            slots = {}
+            for item in session.items:
+                if item.start is None:
+                    continue
+                if item.end <= item.start:
+                    problems.append(Problem(item.lineno, 'time range ends before it starts'))
+                elif isinstance(item, Paper):
+                    slots.setdefault((item.start, item.end), []).append(item)
+            index = IntervalIndex((start, end, papers) for (start, end), papers in slots.items())
+            for group in index.groups():
+                first = min(papers[0].lineno for papers in group)
+                slots_text = ', '.join(f'{format_time(papers[0].start)}--{format_time(papers[0].end)} '
+                                       f'(line{"s" if len(papers) > 1 else ""} '
+                                       f'{", ".join(str(p.lineno) for p in papers)})'
+                                       for papers in group)
+                problems.append(Problem(first, f'overlapping paper slots: {slots_text}'))
+
+        # overlapping sessions within a day
+        spans = ((span[0], span[1], session) for session in day.sessions
+                 for span in [session.span()] if span and session.title is not None
+                 and span[1] > span[0])
+        for group in IntervalIndex(spans).groups():
+            titles = ', '.join(f'"{s.title}" (line {s.lineno})' for s in group[1:])
+            problems.append(Problem(group[0].lineno, f'session "{group[0].title}" overlaps '
+                                                     f'{titles}', error=False))
+
+    # duplicate and unknown paper IDs
+    first_seen = {}
+    for paper in schedule.papers():
+        if paper.paper_id in first_seen:
+            problems.append(Problem(paper.lineno, f'duplicate paper ID {paper.paper_id} '
+                                                  f'(first on line {first_seen[paper.paper_id]})'))
+        else:
+            first_seen[paper.paper_id] = paper.lineno
+    if db_ids is not None:
+        known = set(db_ids)
+        for paper_id, lineno in first_seen.items():
+            if paper_id not in known:
+                problems.append(Problem(lineno, f'unknown paper ID {paper_id} (not in db)'))
+        for paper_id in db_ids:
+            if paper_id not in first_seen:
+                problems.append(Problem(0, f'paper {paper_id} in db is missing from the order',
+                                        error=False))
+
+    return sorted(problems, key=lambda p: p.lineno)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verifies that the ACLPUB order file '
+                                                 'is computer-readable.')
+    parser.add_argument('order', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
+    parser.add_argument('--db', help='db file to check paper IDs against')
+    parser.add_argument('--json', help='write the parsed schedule to this file')
+    args = parser.parse_args()
+
+    schedule, problems = parse_order(args.order)
+    db_ids = read_db_ids(args.db) if args.db else None
+    problems = sorted(problems + check_schedule(schedule, db_ids), key=lambda p: p.lineno)
+    for problem in problems:
+        print(problem)
+
+    if args.json:
+        with open(args.json, 'w') as out:
+            out.write(schedule.to_json())
+
+    error_count = sum(problem.error for problem in problems)
+    print(f'Found {error_count} errors')
+    sys.exit(min(error_count, 255))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,165 @@
 #!/usr/bin/env python3
 
 '''
-merge two pdf files by overlaying pages pairwise
+merge pdf files by overlaying pages pairwise
 
 usage:   pdfunderneath.py my.pdf underneath.pdf [-o output.pdf]
+         pdfunderneath.py -u underneath.pdf [-d outdir] [-j N] a.pdf b.pdf ...
 
-Creates output.pdf, with each page of my.pdf overlaid on
+The first form creates output.pdf, with each page of my.pdf overlaid on
 corresponding page from underneath.pdf.
 
+The second form stamps the same underneath.pdf (e.g., a header and
+footer) under every page of many papers, writing outdir/a.pdf,
+outdir/b.pdf, ... as each paper is done.  Papers are processed by N
+worker processes; underneath.pdf is parsed once per process and its
+pages are turned into Form XObjects once, which are then shared by
+every stamped page rather than re-imported.
+
+Page i of a paper is laid over page i of underneath.pdf.  Pages beyond
+the end of underneath.pdf are left as they are in the first form; in
+the second form they are laid over its last page, so a one-page
+underlay stamps every page.  If the page sizes differ, the underlay page is scaled to
+fit and centered on the paper page.
+
 Uses pdfrw library:
 https://github.com/pmaupin/pdfrw
 
-NOTE 1: This program assumes that all pages 
-        are the same size.  
-
 '''
 
-import sys
+import argparse
 import os
+import sys
+import time
+
+from pdfrw import PdfReader, PdfWriter, PageMerge, IndirectPdfDict, PdfDict, PdfName
+from pdfrw.buildxobj import pagexobj
+
+
+class Underlay(object):
+    '''A parsed underlay pdf whose pages are converted to Form XObjects once.'''
+
+    def __init__(self, fn):
+        self.reader = PdfReader(fn)
+        self.info = self.reader.Info
+        self.xobjs = [pagexobj(page) for page in self.reader.pages]
+
+    def stamp(self, page, i, repeat_last=False):
+        '''Puts underlay page i underneath page.  If there is no page i,
+        puts the last page there if repeat_last, and nothing otherwise.'''
+        if i >= len(self.xobjs):
+            if not repeat_last or not self.xobjs:
+                return
+            i = len(self.xobjs) - 1
+        xobj = self.xobjs[i]
+        merge = PageMerge(page)
+        merge.add(self._fit(xobj, merge.mbox), prepend=1).render()
+
+    @staticmethod
+    def _fit(xobj, mbox):
+        '''Returns xobj itself if it matches mbox, otherwise a small Form
+        XObject that draws the shared xobj scaled and centered in mbox.'''
+        if mbox is None:
+            return xobj
+        ux0, uy0, ux1, uy1 = [float(x) for x in xobj.BBox]
+        px0, py0, px1, py1 = [float(x) for x in mbox]
+        uw, uh, pw, ph = ux1 - ux0, uy1 - uy0, px1 - px0, py1 - py0
+        if (round(uw), round(uh), round(ux0), round(uy0)) == \
+                (round(pw), round(ph), round(px0), round(py0)):
+            return xobj
+        scale = min(pw / uw, ph / uh)
+        tx = px0 + (pw - uw * scale) / 2 - ux0 * scale
+        ty = py0 + (ph - uh * scale) / 2 - uy0 * scale
+        return PdfDict(
+            indirect=True,
+            Type=PdfName.XObject,
+            Subtype=PdfName.Form,
+            FormType=1,
+            BBox=[px0, py0, px1, py1],
+            Resources=PdfDict(XObject=PdfDict(Under=xobj)),
+            stream='q %.6f 0 0 %.6f %.6f %.6f cm /Under Do Q' % (scale, scale, tx, ty),
+        )
+
+
+def overlay(inpfn, underlay, outfn, repeat_last=False):
+    '''Writes inpfn stamped with underlay to outfn; returns the page count.'''
+    trailer = PdfReader(inpfn)
+    for i, page in enumerate(trailer.pages):
+        underlay.stamp(page, i, repeat_last)
+
+    if trailer.Info is None:
+        trailer.Info = IndirectPdfDict({})
+
+    # meta data comes from underneath.pdf
+    if underlay.info is not None:
+        trailer.Info.Title = underlay.info.Title
+        trailer.Info.Author = underlay.info.Author
+        trailer.Info.Subject = underlay.info.Subject
+
+    PdfWriter(outfn, trailer=trailer).write()
+    return len(trailer.pages)
+
+
+underlay = None
+outdir = None
+def init_worker(underfn, dest):
+    """ parse the underlay once per process (already done if forked) """
+    global underlay, outdir
+    if underlay is None:
+        underlay = Underlay(underfn)
+    outdir = dest
+
+
+def worker(inpfn):
+    """ stamp one pdf """
+    outfn = os.path.join(outdir, os.path.basename(inpfn))
+    return inpfn, overlay(inpfn, underlay, outfn, repeat_last=True)
+
 
-from pdfrw import PdfReader, PdfWriter, PageMerge, IndirectPdfDict
+def main():
+    parser = argparse.ArgumentParser(
+        usage='%(prog)s my.pdf underneath.pdf [-o output.pdf]\n'
+              '       %(prog)s -u underneath.pdf [-d outdir] [-j N] a.pdf ...')
+    parser.add_argument('inputs', metavar='pdf', nargs='+')
+    parser.add_argument('-o', dest='outfn', default='output.pdf')
+    parser.add_argument('-u', '--underlay', dest='underfn')
+    parser.add_argument('-d', '--outdir', default='.')
+    parser.add_argument('-j', '--num_workers', type=int, default=1)
+    args = parser.parse_args()
 
-argv = sys.argv[1:]
+    if args.underfn is None:
+        # pairwise mode: my.pdf underneath.pdf
+        if len(args.inputs) != 2:
+            parser.error('expected my.pdf underneath.pdf, or -u underneath.pdf')
+        inpfn, underfn = args.inputs
+        overlay(inpfn, Underlay(underfn), args.outfn)
+        return
 
-if '-o' in argv:
-    outfn = argv[argv.index('-o') + 1]
-    del argv[argv.index('-o') + 1]
-    del argv[argv.index('-o')]
-else:
-    outfn = 'output.pdf'
+    os.makedirs(args.outdir, exist_ok=True)
+    for inpfn in args.inputs:
+        if os.path.abspath(os.path.join(args.outdir, os.path.basename(inpfn))) == \
+                os.path.abspath(inpfn):
+            parser.error(f'{inpfn} would be overwritten; choose another -d')
 
-inpfn, underfn = argv
-under = PdfReader(underfn)
-trailer = PdfReader(inpfn)
-for page,upage in zip(trailer.pages,under.pages):
-    PageMerge(page).add(upage, prepend=1).render()
+    start = time.time()
+    pages = 0
+    init_worker(args.underfn, args.outdir)
+    if args.num_workers > 1:
+        from multiprocessing.pool import Pool
+        with Pool(args.num_workers, init_worker, (args.underfn, args.outdir)) as p:
+            for inpfn, n in p.imap_unordered(worker, args.inputs):
+                pages += n
+                print(f"Stamped {inpfn} ({n} pages)", file=sys.stderr)
+    else:
+        for inpfn in args.inputs:
+            _, n = worker(inpfn)
+            pages += n
+            print(f"Stamped {inpfn} ({n} pages)", file=sys.stderr)
 
-if trailer.Info is None:
-    trailer.Info = IndirectPdfDict({})
-    
-# meta data comes from underneath.pdf
-trailer.Info.Title = under.Info.Title
-trailer.Info.Author = under.Info.Author
-trailer.Info.Subject = under.Info.Subject
+    elapsed = max(time.time() - start, 1e-9)
+    print(f"Stamped {pages} pages in {len(args.inputs)} files in "
+          f"{elapsed:.1f}s ({pages / elapsed:.1f} pages/s)", file=sys.stderr)
 
-PdfWriter(outfn, trailer=trailer).write()
 
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,17 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
 # Matt Post, May 2014
 
 # Verifies that the ACLPUB order file is computer-readable.
 #
 # Usage:
-#   cat proceedings/order | python verify-order-file.py
+#   cat proceedings/order | python3 verify_order.py
 #
 # Output is detailed information about errors found in the file.
+#
+# This script is self-contained so that it can be downloaded on its own.
+# bin/order.py of the ACLPUB package does the same format checks and
+# also checks for overlapping time slots and (with --db) for paper IDs
+# that are not in the db file.
 
 import re
 import sys
@@ -15,11 +19,13 @@ import sys
 DAYS = 'Sunday Monday Tuesday Wednesday Thursday Friday Saturday'.split(' ')
 MONTHS = 'January February March April May June July August September October November December'.split(' ')
 
+error_count = 0
+
 def general_error(lineno, found, expected, eg):
-    print 'Format error on line %d' % (lineno)
-    print '  ->    found: %s' % found
-    print '  -> expected: %s' % expected
-    print '     e.g.,', eg
+    print('Format error on line %d' % (lineno))
+    print('  ->    found: %s' % found)
+    print('  -> expected: %s' % expected)
+    print('     e.g.,', eg)
 
     global error_count
     error_count += 1
@@ -28,25 +34,27 @@ def star_error(lineno, line):
     general_error(lineno, line, '* DAY, MONTH DATE, YEAR', 'Thursday, June 26, 2014')
 
 def plus_error(lineno, line):
-    general_error(lineno, line, '+ HH:MM--HH:MM EVENT TITLE', '+ 14:00-15:30 {\em A Great Talk.} Ellen Elinksy -- Founder, Acme Inc')
+    general_error(lineno, line, '+ HH:MM--HH:MM EVENT TITLE', '+ 14:00-15:30 {\\em A Great Talk.} Ellen Elinksy -- Founder, Acme Inc')
 
-TIMERANGE_REGEXP = r'\d+:\d+--\d+:\d+'
+def paper_error(lineno, line):
+    general_error(lineno, line, 'ID [HH:MM--HH:MM] # TITLE', '17 9:00--9:30 # A really great paper')
+
+TIMERANGE_REGEXP = r'^\d{1,2}:\d\d--\d{1,2}:\d\d$'
 def timerange_error(lineno, line):
     general_error(lineno, line, 'HH:MM--HH:MM (time range, 24-hour format, two dashes)', '12:30--13:30')
 
 def header_error(lineno, line):
-    print 'Warning on line %d' % (lineno)
-    print '  -> Header lines do not contain time ranges'
-    print '  -> Use "=" for headers (display only) and "+" for timed events, e.g.,'
-    print '     + 11:00--12:30 Poster Session: Shared Task'
-    print '     16  # Paper 1'
-    print '     18  # Paper 2'
-    print '     ...'
+    print('Warning on line %d' % (lineno))
+    print('  -> Header lines do not contain time ranges')
+    print('  -> Use "=" for headers (display only) and "+" for timed events, e.g.,')
+    print('     + 11:00--12:30 Poster Session: Shared Task')
+    print('     16  # Paper 1')
+    print('     18  # Paper 2')
+    print('     ...')
 
-error_count = 0
 for i, line in enumerate(sys.stdin, 1):
     line = line.rstrip()
-    
+
     # Skip blanks and comments
     if line == '' or line.startswith('#'):
         continue
@@ -63,9 +71,9 @@ for i, line in enumerate(sys.stdin, 1):
             star_error(i, day)
         elif month not in MONTHS:
             star_error(i, month)
-        elif not re.match(r'\d+', date) or int(date) < 1 or int(date) > 31:
+        elif not re.match(r'^\d+$', date) or int(date) < 1 or int(date) > 31:
             star_error(i, date)
-        elif year != '2015':
+        elif not re.match(r'^\d{4}$', year):
             star_error(i, year)
 
     elif line.startswith('+') or line.startswith('!'):
@@ -73,7 +81,7 @@ for i, line in enumerate(sys.stdin, 1):
             _, timerange, title = line.split(' ', 2)
             if not re.match(TIMERANGE_REGEXP, timerange):
                 timerange_error(i, timerange)
-                
+
         except ValueError:
             plus_error(i, line)
 
@@ -81,14 +89,12 @@ for i, line in enumerate(sys.stdin, 1):
         if re.match(r'.*\d:\d.*', line):
             header_error(i, line)
 
-    elif re.match(r'^\d+ ', line):
-        try:
-            id, timerange, _ = line.split(' ', 2)
-        except ValueError:
+    elif re.match(r'^\d+', line):
+        fields = line.split(None, 2)
+        if not re.match(r'^\d+$', fields[0]):
             paper_error(i, line)
+        elif len(fields) > 1 and re.match(r'\d', fields[1]) and not re.match(TIMERANGE_REGEXP, fields[1]):
+            timerange_error(i, fields[1])
 
-        if re.match(r'\d', timerange) and not re.match(TIMERANGE_REGEXP, timerange):
-            timerange_error(i, timerange)
-            
-print "Found %d errors" % (error_count)
-sys.exit(error_count)
+print("Found %d errors" % (error_count))
+sys.exit(min(error_count, 255))
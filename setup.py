@@ -10,6 +10,7 @@ setup(
     license='Apache 2.0',
     packages=['aclpub_check'],
     install_requires=[
+        'numpy',
         'pdfplumber',
         'tqdm',
         'termcolor'